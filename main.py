@@ -1,15 +1,24 @@
-from typing import Dict, List, Set, Tuple, Type
+from typing import Dict, FrozenSet, List, Optional, Tuple
 import requests
+import requests_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 from lxml import etree
 import datetime
-import pytz
+from zoneinfo import ZoneInfo
 from rich.console import Console
 from rich.table import Table
-from rich.text import Text
 from rich import print
 from collections import defaultdict
 from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
+import csv
+import threading
+import os
+import struct
+import tempfile
+from array import array
 
 #############################################
 # user configs
@@ -18,110 +27,144 @@ import sys
 USER_IDS = ["roeniss"]
 
 # use ethiopia timezone because we consider 06:00(+09:00) as start of the new day
-TIMEZONE = pytz.timezone("Africa/Addis_Ababa")
+TIMEZONE = ZoneInfo("Africa/Addis_Ababa")
 
 START_DATE_FROM_TODAY = 7  # not including today, for our purpose.
 
 MAX_FETCH_PAGE = 5
 MAX_FETCH_SIZE = 200
 
+MAX_FETCH_WORKERS = 32
+
+# rows per status page. a shorter page is the last one.
+STATUS_PAGE_SIZE = 20
+
+# fetched pages are reused for re-runs within this period. pass --refresh to ignore.
+CACHE_EXPIRE_SECONDS = 600
+
 
 #############################################
 # constants
 #############################################
 
 # reference: https://solvedac.github.io/unofficial-documentation/#/operations/getProblemsCountGroupByLevel
-LEVEL_REFERENCE = {
-    0: Text().append("NR", style="turquoise4"),  # not rated
-    1: Text().append("B5", style="orange4"),
-    2: Text().append("B4", style="orange4"),
-    3: Text().append("B3", style="orange4"),
-    4: Text().append("B2", style="orange4"),
-    5: Text().append("B1", style="orange4"),
-    6: Text().append("S5", style="light_steel_blue1"),
-    7: Text().append("S4", style="light_steel_blue1"),
-    8: Text().append("S3", style="light_steel_blue1"),
-    9: Text().append("S2", style="light_steel_blue1"),
-    10: Text().append("S1", style="light_steel_blue1"),
-    11: Text().append("G5", style="gold1"),
-    12: Text().append("G4", style="gold1"),
-    13: Text().append("G3", style="gold1"),
-    14: Text().append("G2", style="gold1"),
-    15: Text().append("G1", style="gold1"),
-    16: Text().append("P5", style="cyan1"),
-    17: Text().append("P4", style="cyan1"),
-    18: Text().append("P3", style="cyan1"),
-    19: Text().append("P2", style="cyan1"),
-    20: Text().append("P1", style="cyan1"),
-    21: Text().append("D5", style="red1"),
-    22: Text().append("D4", style="red1"),
-    23: Text().append("D3", style="red1"),
-    24: Text().append("D2", style="red1"),
-    25: Text().append("D1", style="red1"),
-    26: Text().append("R5", style="magenta1"),
-    27: Text().append("R4", style="magenta1"),
-    28: Text().append("R3", style="magenta1"),
-    29: Text().append("R2", style="magenta1"),
-    30: Text().append("R1", style="magenta1"),
-}
+# every 5 levels make a tier, from bronze (1~5) to ruby (26~30). level 0 is not rated.
+# labels are rich markup, so a cell is built with a plain str.join
+LEVEL_TIERS = [
+    ("B", "orange4"),
+    ("S", "light_steel_blue1"),
+    ("G", "gold1"),
+    ("P", "cyan1"),
+    ("D", "red1"),
+    ("R", "magenta1"),
+]
+NOT_RATED_LABEL = "[turquoise4]NR[/]"
 
 #############################################
 # get user's submission data
 #############################################
 
 
+HEADERS = {
+    "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
+    + "AppleWebKit/537.36 (KHTML, like Gecko)"
+    + "Chrome/128.0.0.0 Safari/537.36"
+}
+
+
 @lru_cache(maxsize=None)
 def _get_session() -> requests.Session:
-    return requests.Session()
+    """
+    Shared by every fetching thread, so the pool is sized for MAX_FETCH_WORKERS
+    to keep connections alive instead of re-creating them.
+    """
+    s = requests_cache.CachedSession(
+        cache_name=".boj_cache", backend="sqlite", expire_after=CACHE_EXPIRE_SECONDS
+    )
+    s.headers.update(HEADERS)
 
+    adapter = HTTPAdapter(
+        pool_connections=MAX_FETCH_WORKERS,
+        pool_maxsize=MAX_FETCH_WORKERS,
+        max_retries=Retry(
+            total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]
+        ),
+    )
+    s.mount("https://", adapter)
 
-def _get_page(user_id: str, top: int) -> str:
+    return s
+
+
+def _get_page(user_id: str, top: int) -> bytes:
     """
     Returns:
-        html
+        html, undecoded. lxml detects the encoding itself.
     """
     url = f"https://www.acmicpc.net/status?user_id={user_id}&result_id=4"
     if top:
         url += f"&top={top}"
 
-    headers = {
-        "user-agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7)"
-        + "AppleWebKit/537.36 (KHTML, like Gecko)"
-        + "Chrome/128.0.0.0 Safari/537.36"
-    }
+    response = _get_session().get(url)
+
+    return response.content
 
-    response = _get_session().get(url, headers=headers)
 
-    return response.text
+# compiled once, instead of translating css selectors to xpath on every call
+_ROWS_XPATH = etree.XPath(
+    "//table[contains(concat(' ', normalize-space(@class), ' '), ' table ')]//tr"
+)
+_TDS_XPATH = etree.XPath("./td")
+_ANCHORS_XPATH = etree.XPath(".//a")
 
 
-def _parse_time_to_problem_id(html: str) -> Tuple[Dict[int, int], int]:
+_html_parser_local = threading.local()
+
+
+def _get_html_parser() -> etree.HTMLParser:
+    """
+    lxml parsers can't be shared between threads, so one is kept per fetching thread.
+    """
+    parser = getattr(_html_parser_local, "parser", None)
+    if parser is None:
+        parser = etree.HTMLParser(
+            remove_blank_text=True, remove_comments=True, no_network=True
+        )
+        _html_parser_local.parser = parser
+    return parser
+
+
+def _parse_time_to_problem_id(html: bytes) -> Tuple[Dict[int, int], Optional[int]]:
     """
     Last accepted submission id is the problem's submit time.
-    Last submit id is also returned for cursor-based pagination
+    Last submit id is also returned for cursor-based pagination,
+    or None if this is the last page.
 
     Returns:
         submit_time to problem_id, last_submit_id
     """
-    time_to_problem_id = defaultdict(lambda: 0)
+    time_to_problem_id = defaultdict(int)
+    last_submit_id = None
+
+    html = etree.fromstring(html, _get_html_parser())
 
-    html = etree.HTML(html)
-    trs = html.cssselect("table.table tr")[1:]
+    trs = _ROWS_XPATH(html)[1:]
 
     for tr in trs:
-        tds = tr.cssselect("td")
+        tds = _TDS_XPATH(tr)
 
         try:
             last_submit_id = int(tds[0].text)
-            problem_id = int(tds[2].cssselect("a")[0].text)
-            submit_time = int(tds[8].cssselect("a")[0].attrib["data-timestamp"])
+            problem_id = int(_ANCHORS_XPATH(tds[2])[0].text)
+            submit_time = int(_ANCHORS_XPATH(tds[8])[0].attrib["data-timestamp"])
         except IndexError:
             # some row is blank (redacted?)
             continue
 
-        time_to_problem_id[submit_time] = max(
-            time_to_problem_id[submit_time], int(problem_id)
-        )
+        if problem_id > time_to_problem_id[submit_time]:
+            time_to_problem_id[submit_time] = problem_id
+
+    if len(trs) < STATUS_PAGE_SIZE:
+        last_submit_id = None
 
     return time_to_problem_id, last_submit_id
 
@@ -134,9 +177,8 @@ def _merge_dicts(dict1: Dict[any, int], dict2: Dict[any, int]) -> None:
         value is expected to be int
     """
     for key, value in dict2.items():
-        if key in dict1:
-            dict1[key] = max(dict1[key], value)
-        else:
+        current = dict1.get(key)
+        if current is None or value > current:
             dict1[key] = value
 
 
@@ -148,71 +190,244 @@ def get_time_to_problem_id(user_id: int) -> Dict[int, int]:
     time_to_problem_id = {}
     last_submit_id = ""
 
+    # submissions older than this are not displayed, so no need to fetch further
+    cutoff_time = int(
+        (
+            datetime.datetime.now(tz=TIMEZONE)
+            - datetime.timedelta(days=START_DATE_FROM_TODAY + 1)
+        ).timestamp()
+    )
+
     left_page = MAX_FETCH_PAGE
-    while left_page > 0 and len(time_to_problem_id) < MAX_FETCH_SIZE:
+    while (
+        left_page > 0
+        and len(time_to_problem_id) < MAX_FETCH_SIZE
+        and last_submit_id is not None
+    ):
         left_page -= 1
         html = _get_page(user_id, last_submit_id)
         data, last_submit_id = _parse_time_to_problem_id(html)
         _merge_dicts(time_to_problem_id, data)
 
+        if data and min(data) < cutoff_time:
+            break
+
     return time_to_problem_id
 
 
+def get_time_to_problem_id_per_user(user_ids: List[str]) -> Dict[str, Dict[int, int]]:
+    """
+    Fetch users concurrently. Pages of a single user are still fetched in order
+    because of the cursor-based pagination.
+
+    Returns:
+        user_id to (last_submit_time to problem_id), in the order of user_ids
+    """
+    if not user_ids:
+        return {}
+
+    # lru_cache doesn't stop threads from creating sessions concurrently,
+    # so the shared session is created before any worker starts.
+    _get_session()
+
+    results = {}
+    with ThreadPoolExecutor(
+        max_workers=min(MAX_FETCH_WORKERS, len(user_ids))
+    ) as executor:
+        futures = {
+            executor.submit(get_time_to_problem_id, user_id): user_id
+            for user_id in user_ids
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+
+    return {user_id: results[user_id] for user_id in user_ids}
+
+
 #############################################
 # visualize the data
 #############################################
 
 
-@lru_cache(maxsize=None)
-def _get_problem_level_dict() -> Dict[int, int]:
-    problem_level_dict = {}
+PROBLEM_LEVEL_MAPPING_PATH = "./problem_level_mapping.csv"
 
-    with open("./problem_level_mapping.csv", "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            if "," not in line:
+# parsed mapping, reused while the csv file is unchanged
+PROBLEM_LEVEL_CACHE_PATH = "./problem_level_mapping.bin"
+
+# (version, csv size, csv mtime_ns, number of levels), followed by the level bytes
+_PROBLEM_LEVEL_CACHE_HEADER = struct.Struct("<4q")
+
+
+# bump when the cached data format changes
+PROBLEM_LEVEL_CACHE_VERSION = 3
+
+# problem ids are dense, so levels are stored in a byte array indexed by problem id.
+# unknown problems are left as 0, which is "not rated".
+NOT_RATED_LEVEL = 0
+MAX_LEVEL = 30
+
+
+def _read_problem_level_mapping() -> array:
+    rows = []
+
+    with open(PROBLEM_LEVEL_MAPPING_PATH, "r", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) != 2:
                 continue
 
-            _problem_id, level = line.split(",")
+            _problem_id, level = row
+
+            rows.append((int(_problem_id), int(level)))
 
-            problem_level_dict[int(_problem_id)] = int(level)
+    max_problem_id = max((problem_id for problem_id, _ in rows), default=-1)
+    problem_levels = array("B", bytes(max_problem_id + 1))
+    for problem_id, level in rows:
+        problem_levels[problem_id] = level
 
-    return problem_level_dict
+    return problem_levels
 
 
-def _get_problem_levels(problem_ids: Set[int]) -> List[Type[Text]]:
+def _load_problem_level_cache(key: Tuple[int, ...]) -> Optional[array]:
     """
     Returns:
-        problems' level formatted with rich.Text
+        cached mapping, or None if there is no valid cache for the given key
+    """
+    try:
+        with open(PROBLEM_LEVEL_CACHE_PATH, "rb") as f:
+            raw = f.read()
+    except OSError:
+        return None
+
+    header_size = _PROBLEM_LEVEL_CACHE_HEADER.size
+    if len(raw) < header_size:
+        return None
+
+    *cached_key, length = _PROBLEM_LEVEL_CACHE_HEADER.unpack_from(raw)
+    if tuple(cached_key) != key or len(raw) - header_size != length:
+        return None
+
+    problem_levels = array("B")
+    problem_levels.frombytes(raw[header_size:])
+    if max(problem_levels, default=NOT_RATED_LEVEL) > MAX_LEVEL:
+        return None
+
+    return problem_levels
+
+
+def _save_problem_level_cache(key: Tuple[int, ...], data: array) -> None:
+    """
+    Written to a temporary file first, so a broken cache is never left behind.
+    Failing to write the cache is not an error.
+    """
+    cache_dir = os.path.dirname(os.path.abspath(PROBLEM_LEVEL_CACHE_PATH))
+    try:
+        with tempfile.NamedTemporaryFile("wb", dir=cache_dir, delete=False) as f:
+            f.write(_PROBLEM_LEVEL_CACHE_HEADER.pack(*key, len(data)))
+            data.tofile(f)
+        os.replace(f.name, PROBLEM_LEVEL_CACHE_PATH)
+    except OSError:
+        pass
+
+
+@lru_cache(maxsize=None)
+def _get_problem_level_array() -> array:
+    st = os.stat(PROBLEM_LEVEL_MAPPING_PATH)
+    key = (PROBLEM_LEVEL_CACHE_VERSION, st.st_size, st.st_mtime_ns)
+
+    problem_levels = _load_problem_level_cache(key)
+    if problem_levels is None:
+        problem_levels = _read_problem_level_mapping()
+        _save_problem_level_cache(key, problem_levels)
+
+    return problem_levels
+
+
+@lru_cache(maxsize=None)
+def _get_level_label(level: int) -> str:
+    """
+    Returns:
+        level label formatted with rich markup. e.g. "[gold1]G4[/]" for 12
+    """
+    if level == NOT_RATED_LEVEL:
+        return NOT_RATED_LABEL
+
+    tier, color = LEVEL_TIERS[(level - 1) // 5]
+    return f"[{color}]{tier}{5 - (level - 1) % 5}[/]"
+
+
+def _get_problem_levels(
+    problem_ids: FrozenSet[int], problem_levels: array
+) -> List[str]:
+    """
+    Unknown problems are treated as not rated.
+
+    Returns:
+        problems' level formatted with rich markup
     """
     if not problem_ids:
         return []
 
-    problem_level_dict = _get_problem_level_dict()
-    levels = [problem_level_dict.get(i) for i in problem_ids]
-    levels = reversed(sorted(levels))
+    size = len(problem_levels)
+    levels = [problem_levels[i] if i < size else NOT_RATED_LEVEL for i in problem_ids]
+    levels.sort(reverse=True)
+
+    return [_get_level_label(i) for i in levels]
+
 
-    return [LEVEL_REFERENCE[i] for i in levels]
+SECONDS_PER_DAY = 24 * 60 * 60
 
+EPOCH_DATE = datetime.date(1970, 1, 1)
 
-def _parse_date(date: str) -> datetime.date:
-    return datetime.datetime.fromtimestamp(date, tz=TIMEZONE).date()
+
+def _get_utc_offset_seconds() -> int:
+    """
+    TIMEZONE is expected to have a fixed offset, so it is not looked up per submission.
+    """
+    return int(datetime.datetime.now(tz=TIMEZONE).utcoffset().total_seconds())
 
 
 def _get_today() -> datetime.date:
     return datetime.datetime.now(tz=TIMEZONE).date()
 
 
+GROUPING_CACHE_SIZE = 128
+
+
 def _group_problem_ids_per_day(
-    time_to_problem_id: Dict[int, int]
-) -> Dict[datetime.date, Set]:
-    date_to_problem_ids = defaultdict(set)
+    time_to_problem_id: Dict[int, int], days: List[datetime.date]
+) -> Tuple[FrozenSet[int], ...]:
+    """
+    Memoized by the content of the arguments. Building the key costs about as
+    much as grouping, so this is overhead within a single run, paid so that
+    repeated renders of the same data can skip the grouping.
+
+    Returns:
+        problem ids of each day, in the order of days
+    """
+    return _group_problem_ids_per_day_cached(
+        frozenset(time_to_problem_id.items()), tuple(days)
+    )
+
+
+@lru_cache(maxsize=GROUPING_CACHE_SIZE)
+def _group_problem_ids_per_day_cached(
+    submissions: FrozenSet[Tuple[int, int]], days: Tuple[datetime.date, ...]
+) -> Tuple[FrozenSet[int], ...]:
+    """
+    Submit times are bucketed by integer division into days since the epoch,
+    and dispatched straight into the bucket of the matching day.
+    Submissions outside of days are skipped.
+    """
+    offset = _get_utc_offset_seconds()
+    day_index = {(day - EPOCH_DATE).days: i for i, day in enumerate(days)}
+    buckets = [set() for _ in days]
 
-    for submit_time, problem_id in time_to_problem_id.items():
-        date = _parse_date(submit_time)
-        date_to_problem_ids[date].add(problem_id)
+    for submit_time, problem_id in submissions:
+        i = day_index.get((submit_time + offset) // SECONDS_PER_DAY)
+        if i is not None:
+            buckets[i].add(problem_id)
 
-    return date_to_problem_ids
+    return tuple(frozenset(bucket) for bucket in buckets)
 
 
 def view_table(user_statistics_list: Dict[str, Dict[int, int]]) -> None:
@@ -226,22 +441,20 @@ def view_table(user_statistics_list: Dict[str, Dict[int, int]]) -> None:
     for day in days:
         table.add_column(f'{day.strftime("%m-%d (%a)")}')
 
+    problem_levels = _get_problem_level_array()
+
     for user, time_to_problem_id in user_statistics_list.items():
         columns = [user]
-        date_to_problem_ids = _group_problem_ids_per_day(time_to_problem_id)
+        problem_ids_per_day = _group_problem_ids_per_day(time_to_problem_id, days)
 
-        for day in days:
-            problem_ids = date_to_problem_ids.get(day)
+        for problem_ids in problem_ids_per_day:
             if not problem_ids:
                 columns.append("-")
                 continue
 
-            levels = _get_problem_levels(problem_ids)
+            levels = _get_problem_levels(problem_ids, problem_levels)
 
-            columns.append(levels[0])
-            for level in levels[1:]:
-                columns[-1] += ", "
-                columns[-1] += level
+            columns.append(", ".join(levels))
         table.add_row(*columns)
 
     Console().print(table)
@@ -252,15 +465,26 @@ def view_table(user_statistics_list: Dict[str, Dict[int, int]]) -> None:
 #############################################
 
 
+REFRESH_FLAG = "--refresh"
+
+
 def _get_user_ids() -> List[str]:
-    if len(sys.argv) > 1:
-        return sys.argv[1:]
+    user_ids = [arg for arg in sys.argv[1:] if arg != REFRESH_FLAG]
+    if user_ids:
+        return user_ids
     return USER_IDS
 
 
+def _is_refresh_requested() -> bool:
+    return REFRESH_FLAG in sys.argv[1:]
+
+
 if __name__ == "__main__":
     user_ids = _get_user_ids()
 
-    stats = {user_id: get_time_to_problem_id(user_id) for user_id in user_ids}
+    if _is_refresh_requested():
+        _get_session().cache.clear()
+
+    stats = get_time_to_problem_id_per_user(user_ids)
 
     view_table(stats)